@@ -1,29 +1,57 @@
 import pandas as pd
+import csv
 import json
+import numpy as np
 from app.rag_engine import RAGEngine
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
-def load_train_data(path="data/train.csv") -> Dict[str, List[str]]:
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # Fall back to per-query recall
+    NUMBA_AVAILABLE = False
+    prange = range
+    
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+def load_train_data(path="data/train.csv") -> Tuple[Dict[str, List[int]], Dict[str, int]]:
     """
     Load labeled training data
     
+    URLs are mapped to dense int IDs once here, ready to be packed for
+    recall_batch.
+    
+    Returns:
+        (query -> sorted unique ground truth IDs, url -> int ID)
+    
     Expected CSV format:
     Query,Assessment_url
     Query 1,https://...
     Query 1,https://...
     Query 2,https://...
     """
-    df = pd.read_csv(path)
+    df = pd.read_csv(path, usecols=['Query', 'Assessment_url'], dtype='string')
+    df = df.dropna(subset=['Query'])  # groupby used to drop these implicitly
+    
+    # Group URLs by query (plain dict loop avoids groupby.apply overhead)
+    urls_by_query = {}
+    for query, url in df.itertuples(index=False, name=None):
+        urls_by_query.setdefault(query, []).append(url)
     
-    # Group URLs by query
-    grouped = df.groupby('Query')['Assessment_url'].apply(list).to_dict()
+    url2id = {url: i for i, url in enumerate(sorted(set(df['Assessment_url'].dropna())))}
+    grouped = {
+        query: sorted({url2id[url] for url in urls if url in url2id})
+        for query, urls in urls_by_query.items()
+    }
     
     print(f"📚 Loaded {len(grouped)} training queries")
-    return grouped
+    return grouped, url2id
 
 def calculate_recall_at_k(predicted_urls: List[str], 
-                          ground_truth_urls: List[str], 
-                          k: int = 10) -> float:
+                          relevant_ids: List[int], 
+                          url2id: Dict[str, int],
+                          k: int = 10) -> Tuple[float, int]:
     """
     Calculate Recall@K metric
     
@@ -31,24 +59,73 @@ def calculate_recall_at_k(predicted_urls: List[str],
     
     Args:
         predicted_urls: List of URLs returned by system (in rank order)
-        ground_truth_urls: List of correct URLs for this query
+        relevant_ids: Sorted unique IDs of correct URLs for this query
+        url2id: URL -> ID mapping from load_train_data
         k: Number of top results to consider
     
     Returns:
-        Recall score between 0 and 1
+        Tuple of (recall score between 0 and 1, number of hits)
     """
-    predicted_set = set(predicted_urls[:k])
-    relevant_set = set(ground_truth_urls)
+    if len(relevant_ids) == 0:
+        return 0.0, 0
     
-    if len(relevant_set) == 0:
-        return 0.0
+    # URLs outside the ground truth vocabulary can never be hits
+    predicted_ids = np.unique([url2id[u] for u in predicted_urls[:k] if u in url2id])
     
     # Count how many relevant items we retrieved
-    hits = len(predicted_set.intersection(relevant_set))
+    hits = len(np.intersect1d(predicted_ids, relevant_ids, assume_unique=True))
+    
+    return hits / len(relevant_ids), hits
+
+@njit(parallel=True, cache=True)
+def recall_batch(pred_ids, pred_offsets, gt_ids, gt_offsets, k):
+    """
+    Recall@K for many queries at once over CSR-packed int ID arrays
+    
+    Recall@K = (Number of relevant items in top-K) / (Total relevant items)
+    
+    Query i's predictions are pred_ids[pred_offsets[i]:pred_offsets[i+1]]
+    (rank order, -1 for unknown URLs, no duplicates); its ground truth is
+    laid out the same way in gt_ids / gt_offsets, sorted per query so each
+    prediction is a binary search: O(K log |GT|) per query.
+    
+    Returns:
+        (recall per query, hits per query)
+    """
+    n = len(pred_offsets) - 1
+    recalls = np.zeros(n, dtype=np.float64)
+    hits = np.zeros(n, dtype=np.int64)
+    
+    for i in prange(n):
+        gt_start, gt_end = gt_offsets[i], gt_offsets[i + 1]
+        if gt_end == gt_start:
+            continue
+        
+        pred_start = pred_offsets[i]
+        pred_end = min(pred_offsets[i + 1], pred_start + k)
+        
+        gt = gt_ids[gt_start:gt_end]
+        h = 0
+        for p in range(pred_start, pred_end):
+            pos = np.searchsorted(gt, pred_ids[p])
+            if pos < len(gt) and gt[pos] == pred_ids[p]:
+                h += 1
+        
+        hits[i] = h
+        recalls[i] = h / (gt_end - gt_start)
     
-    return hits / len(relevant_set)
+    return recalls, hits
+
+def _pack_csr(rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten lists of int IDs into (ids, offsets) int32 arrays"""
+    offsets = np.zeros(len(rows) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    ids = np.fromiter((i for row in rows for i in row), dtype=np.int32, count=int(offsets[-1]))
+    return ids, offsets
 
-def evaluate_engine(engine: RAGEngine, train_data: Dict[str, List[str]]) -> float:
+def evaluate_engine(engine: RAGEngine,
+                    train_data: Dict[str, List[int]],
+                    url2id: Dict[str, int]) -> float:
     """
     Evaluate RAG engine on training data
     
@@ -58,27 +135,41 @@ def evaluate_engine(engine: RAGEngine, train_data: Dict[str, List[str]]) -> floa
     print("🧪 EVALUATION ON TRAIN SET")
     print("="*60 + "\n")
     
-    recalls = []
-    
-    for query, ground_truth_urls in train_data.items():
-        # Get predictions
-        results = engine.process_query(query)
-        predicted_urls = [r['url'] for r in results]
-        
-        # Calculate recall
-        recall = calculate_recall_at_k(predicted_urls, ground_truth_urls, k=10)
-        recalls.append(recall)
-        
+    queries = list(train_data)
+    
+    # Get predictions for all queries in one batch
+    all_results = engine.process_queries(queries)
+    # Take the top-K first, then drop duplicates (like set(urls[:k]))
+    predicted = [
+        list(dict.fromkeys([r['url'] for r in results][:10]))
+        for results in all_results
+    ]
+    
+    if NUMBA_AVAILABLE:
+        # Calculate all recalls in one pass over packed int IDs
+        pred_ids, pred_offsets = _pack_csr([[url2id.get(u, -1) for u in urls] for urls in predicted])
+        gt_ids, gt_offsets = _pack_csr([train_data[q] for q in queries])
+        recalls, hits = recall_batch(pred_ids, pred_offsets, gt_ids, gt_offsets, 10)
+    else:
+        # Without the JIT the per-query path is the faster one
+        pairs = [
+            calculate_recall_at_k(urls, train_data[q], url2id, k=10)
+            for urls, q in zip(predicted, queries)
+        ]
+        recalls = np.array([r for r, _ in pairs], dtype=np.float64)
+        hits = [h for _, h in pairs]
+    
+    for i, query in enumerate(queries):
         # Detailed output
         print(f"Query: {query[:60]}...")
-        print(f"  Ground Truth: {len(ground_truth_urls)} assessments")
-        print(f"  Predicted: {len(predicted_urls)} assessments")
-        print(f"  Recall@10: {recall:.3f}")
-        print(f"  Hits: {len(set(predicted_urls).intersection(set(ground_truth_urls)))}")
+        print(f"  Ground Truth: {len(train_data[query])} assessments")
+        print(f"  Predicted: {len(predicted[i])} assessments")
+        print(f"  Recall@10: {recalls[i]:.3f}")
+        print(f"  Hits: {hits[i]}")
         print()
     
     # Compute mean
-    mean_recall = sum(recalls) / len(recalls) if recalls else 0.0
+    mean_recall = float(recalls.mean()) if len(recalls) else 0.0
     
     print("="*60)
     print(f"📊 FINAL SCORE: Mean Recall@10 = {mean_recall:.4f}")
@@ -105,26 +196,23 @@ def generate_test_predictions(engine: RAGEngine,
     # Load test queries
     test_df = pd.read_csv(test_queries_path)
     
-    rows = []
-    for idx, query in enumerate(test_df['Query'], 1):
-        print(f"[{idx}/{len(test_df)}] Processing: {query[:50]}...")
-        
-        # Get recommendations
-        results = engine.process_query(query)
-        
-        # Add to output (top 10)
-        for result in results[:10]:
-            rows.append({
-                'Query': query,
-                'Assessment_url': result['url']
-            })
+    # Get recommendations for all queries in one batch
+    print(f"Processing {len(test_df)} queries...")
+    all_results = engine.process_queries(list(test_df['Query']))
     
-    # Save CSV
-    output_df = pd.DataFrame(rows)
-    output_df.to_csv(output_path, index=False)
+    # Stream rows straight to CSV (top 10 per query)
+    row_count = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(['Query', 'Assessment_url'])
+        
+        for query, results in zip(test_df['Query'], all_results):
+            for result in results[:10]:
+                writer.writerow([query, result['url']])
+                row_count += 1
     
     print(f"\n✅ Predictions saved to {output_path}")
-    print(f"   Total rows: {len(output_df)}")
+    print(f"   Total rows: {row_count}")
     print(f"   Format: Query, Assessment_url")
 
 def main():
@@ -141,8 +229,8 @@ def main():
     
     # Evaluate on train set
     try:
-        train_data = load_train_data("data/train.csv")
-        mean_recall = evaluate_engine(engine, train_data)
+        train_data, url2id = load_train_data("data/train.csv")
+        mean_recall = evaluate_engine(engine, train_data, url2id)
         
         if mean_recall < 0.3:
             print("⚠ WARNING: Low recall score. Consider:")
@@ -2,12 +2,20 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from app.models import QueryRequest, RecommendResponse, Assessment
 from app.rag_engine import RAGEngine
+from contextlib import asynccontextmanager
 import time
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release the engine's HTTP client and URL cache on shutdown"""
+    yield
+    await engine.aclose()
+
 app = FastAPI(
     title="SHL Assessment Recommendation API",
     description="AI-powered assessment recommendation system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration for frontend
@@ -36,8 +44,14 @@ def health_check():
         "timestamp": time.time()
     }
 
-@app.post("/recommend", response_model=RecommendResponse)
-def recommend_assessments(request: QueryRequest):
+# response_model=None skips FastAPI's response re-validation; the schema is
+# still documented through `responses`
+@app.post(
+    "/recommend",
+    response_model=None,
+    responses={200: {"model": RecommendResponse}}
+)
+async def recommend_assessments(request: QueryRequest):
     """
     Assessment recommendation endpoint (required by assignment)
     
@@ -56,27 +70,17 @@ def recommend_assessments(request: QueryRequest):
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         
         # Get recommendations from RAG engine
-        results = engine.process_query(query)
+        results = await engine.process_query_async(query)
         
         # Ensure minimum 5 results (required by assignment)
         if len(results) < 5:
             print(f"⚠ Only {len(results)} results found (minimum 5 required)")
         
-        # Convert to Pydantic models
-        assessments = [
-            Assessment(
-                url=r['url'],
-                name=r['name'],
-                adaptive_support=r['adaptive_support'],
-                description=r['description'],
-                duration=r['duration'],
-                remote_support=r['remote_support'],
-                test_type=r['test_type']
-            )
-            for r in results
-        ]
+        # Convert to Pydantic models without re-validating our own index data
+        # (model_construct also drops internal metadata such as cat_flag)
+        assessments = [Assessment.model_construct(**r) for r in results]
         
-        return RecommendResponse(recommended_assessments=assessments)
+        return RecommendResponse.model_construct(recommended_assessments=assessments)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
@@ -1,8 +1,19 @@
 import os
+import re
 import json
+import asyncio
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
 import chromadb
+import diskcache
 import google.generativeai as genai
 from firecrawl import FirecrawlApp
+from keybert import KeyBERT
 from sentence_transformers import SentenceTransformer
 from app.scraper_catalog import scrape_catalog
 from dotenv import load_dotenv
@@ -18,13 +29,108 @@ if GENAI_KEY:
 
 firecrawl = FirecrawlApp(api_key=FIRECRAWL_KEY) if FIRECRAWL_KEY else None
 
+# FireCrawl REST endpoint (used directly by the async path)
+FIRECRAWL_SCRAPE_URL = "https://api.firecrawl.dev/v1/scrape"
+
+# On-disk cache for scraped URLs
+URL_CACHE_DIR = "./cache/urls"
+URL_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Gemini prompt for query balancing (hard + soft skills)
+BALANCE_PROMPT = """
+You are an expert HR assessment analyst. Analyze this job requirement:
+"{text}"
+
+Extract the key requirements in TWO categories:
+1. HARD SKILLS: Technical abilities, tools, programming languages, certifications, domain knowledge
+2. SOFT SKILLS: Personality traits, teamwork, leadership, communication, behavioral competencies
+
+Create a balanced search query that gives EQUAL weight to both categories.
+Format: "Technical: [list key hard skills] AND Behavioral: [list key soft skills]"
+
+Example Output: "Technical: Java, SQL, API development AND Behavioral: team collaboration, stakeholder management"
+
+If only one category is present, still structure the output the same way.
+"""
+
+# Local query balancing: KeyBERT keywords split by a soft-skill lexicon.
+# Gemini is only called when fewer than LOCAL_BALANCE_MIN_KEYWORDS are found.
+LOCAL_BALANCE_MIN_KEYWORDS = 3
+# Word prefixes, so inflections ("collaborating", "teams", "leading") match too
+SOFT_SKILL_RE = re.compile(
+    r"\b(?:adapt|attitud|behavio|coach|collaborat|communicat|cooperat|creativ|"
+    r"empath|ethic|flexib|influenc|integrity|interpersonal|lead|mentor|motivat|"
+    r"negotiat|personality|persuas|proactiv|relationship|resilien|stakeholder|team)"
+)
+
+# Query cache configuration
+QUERY_CACHE_SIZE = 1024
+SEMANTIC_CACHE_THRESHOLD = 0.97  # Cosine similarity; set to None to disable
+
+# Embedding model
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Dynamically quantized int8 ONNX export shipped in the model repo (uses VNNI
+# int8 dot products on modern x86). Set EMBEDDING_ONNX_FILE="" for fp32 PyTorch.
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# Catalog paths
+ASSESSMENTS_PATH = "data/assessments.json"
+EMBEDDING_CACHE_DIR = "data"
+
+# Category bitflags stored in ChromaDB metadata as `cat_flag`
+CAT_KNOWLEDGE = 1    # Knowledge & Skills / Cognitive Ability
+CAT_PERSONALITY = 2  # Personality & Behavior
+CAT_OTHER = 4        # Anything else
+
+def load_embedder():
+    """
+    Load the sentence embedder, preferring ONNX Runtime with int8 weights
+    
+    Returns:
+        (SentenceTransformer, backend id used to key on-disk embedding caches)
+    """
+    if EMBEDDING_ONNX_FILE:
+        try:
+            embedder = SentenceTransformer(
+                EMBEDDING_MODEL,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+            print(f"⚡ Using ONNX embedder ({EMBEDDING_ONNX_FILE})")
+            return embedder, f"{EMBEDDING_MODEL}:{EMBEDDING_ONNX_FILE}"
+        except Exception as e:
+            print(f"⚠ ONNX embedder unavailable ({e}). Falling back to PyTorch.")
+    
+    return SentenceTransformer(EMBEDDING_MODEL), EMBEDDING_MODEL
+
+def category_flag(test_types: list) -> int:
+    """Compute the cat_flag bitmask for an assessment's test types"""
+    flag = 0
+    if "Knowledge & Skills" in test_types or "Cognitive Ability" in test_types:
+        flag |= CAT_KNOWLEDGE
+    if "Personality & Behavior" in test_types:
+        flag |= CAT_PERSONALITY
+    return flag or CAT_OTHER
+
+def result_category(meta: dict) -> int:
+    """Return the single balancing category (CAT_*) of a search result"""
+    flag = meta.get('cat_flag')
+    if flag is None:  # Indexed before cat_flag existed
+        flag = category_flag(meta.get('test_type', []))
+    
+    if flag & CAT_KNOWLEDGE:
+        return CAT_KNOWLEDGE
+    if flag & CAT_PERSONALITY:
+        return CAT_PERSONALITY
+    return CAT_OTHER
+
 class RAGEngine:
     """
     Retrieval-Augmented Generation Engine for SHL Assessments
     
     Pipeline:
     1. URL Detection → FireCrawl scraping (if URL provided)
-    2. Query Balancing → Gemini extracts hard + soft skills
+    2. Query Balancing → KeyBERT (or Gemini fallback) extracts hard + soft skills
     3. Vector Search → ChromaDB retrieves similar assessments
     4. Result Balancing → Ensures mix of technical + behavioral tests
     """
@@ -35,44 +141,115 @@ class RAGEngine:
         # Ensure data exists
         scrape_catalog()
         
+        # Embedding model (384-dimensional vectors)
+        self.embedder, self.embedder_id = load_embedder()
+        
         # IMPROVED: Persistent ChromaDB (survives restarts)
         self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="shl_assessments",
-            metadata={"hnsw:space": "cosine"}  # Cosine similarity for text
-        )
+        self.collection = self._open_collection()
         
-        # Embedding model (384-dimensional vectors)
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        # Local keyword extractor (reuses the same embedder)
+        self._kw = KeyBERT(self.embedder)
+        
+        # Gemini model for query balancing fallback (created once)
+        self._gemini_model = genai.GenerativeModel('gemini-1.5-flash') if GENAI_KEY else None
+        
+        # Index data if collection is empty, predates cat_flag metadata, or
+        # was embedded with a different model / backend
+        if self.collection.count() > 0:
+            stale_reason = None
+            indexed_with = (self.collection.metadata or {}).get("embedder")
+            if indexed_with != self.embedder_id:
+                stale_reason = f"was embedded with {indexed_with}"
+            elif not self._has_cat_flags():
+                stale_reason = "is missing cat_flag metadata"
+            
+            if stale_reason:
+                print(f"♻ Collection {stale_reason}. Re-indexing...")
+                self.chroma_client.delete_collection("shl_assessments")
+                self.collection = self._open_collection()
         
-        # Index data if collection is empty
         if self.collection.count() == 0:
             self._index_data()
         else:
             print(f"✅ Loaded {self.collection.count()} assessments from ChromaDB")
+        
+        # Query cache: exact match on raw input, then semantic match on embeddings
+        self._balanced_cache = OrderedDict()  # search text -> balanced query (sync + async)
+        self._emb_cache = OrderedDict()  # raw query -> (row in _emb_matrix, query embedding)
+        self._emb_matrix = None          # preallocated raw embeddings for semantic lookup
+        self._emb_keys = [None] * QUERY_CACHE_SIZE  # raw query stored in each row
+        self._cache_lock = threading.Lock()
+        
+        # Shared HTTP client for async FireCrawl calls
+        self._http = httpx.AsyncClient(timeout=30)
+        
+        # Scraped job descriptions, persisted across restarts
+        self._url_cache = diskcache.Cache(URL_CACHE_DIR)
+    
+    
+    def _open_collection(self):
+        """Get or create the assessments collection, tagged with the embedder id"""
+        return self.chroma_client.get_or_create_collection(
+            name="shl_assessments",
+            metadata={
+                "hnsw:space": "cosine",  # Cosine similarity for text
+                "embedder": self.embedder_id
+            }
+        )
+    
+    
+    def _has_cat_flags(self) -> bool:
+        """Check whether the persisted collection has cat_flag metadata"""
+        sample = self.collection.get(limit=1, include=['metadatas'])
+        return bool(sample['metadatas']) and 'cat_flag' in sample['metadatas'][0]
     
     
     def _index_data(self):
         """Index scraped assessments into vector database"""
         print("🧠 Indexing assessments into ChromaDB...")
         
-        with open("data/assessments.json", "r") as f:
-            data = json.load(f)
+        with open(ASSESSMENTS_PATH, "rb") as f:
+            raw = f.read()
+        data = json.loads(raw)
         
-        # Create rich text representation for embedding
-        documents = []
-        for item in data:
-            doc = f"{item['name']} {item['description']} {' '.join(item['test_type'])}"
-            documents.append(doc)
+        # Rich text representation for embedding, precomputed by the scraper
+        # (built here for catalogs scraped before `_doc` existed)
+        documents = [
+            item.get('_doc') or f"{item['name']} {item['description']} {' '.join(item['test_type'])}"
+            for item in data
+        ]
         
-        # Generate embeddings
-        embeddings = self.embedder.encode(documents, show_progress_bar=True).tolist()
+        # Generate embeddings (cached on disk, keyed by model + catalog content)
+        digest = hashlib.md5(self.embedder_id.encode() + raw).hexdigest()
+        cache_path = os.path.join(EMBEDDING_CACHE_DIR, f"emb_{digest}.npy")
+        
+        if os.path.exists(cache_path):
+            print(f"📦 Loading cached embeddings from {cache_path}")
+            embeddings = np.load(cache_path, mmap_mode='r')
+        else:
+            embeddings = self.embedder.encode(
+                documents, show_progress_bar=True, convert_to_numpy=True
+            ).astype(np.float32)
+            np.save(cache_path, embeddings)
+            
+            # Drop caches for older catalogs / models
+            for stale in glob.glob(os.path.join(EMBEDDING_CACHE_DIR, "emb_*.npy")):
+                if os.path.abspath(stale) != os.path.abspath(cache_path):
+                    os.remove(stale)
+        
+        # Precompute category flags so result balancing avoids string scans
+        metadatas = [
+            {**{k: v for k, v in item.items() if k != '_doc'},
+             'cat_flag': category_flag(item['test_type'])}
+            for item in data
+        ]
         
         # Store in ChromaDB
         self.collection.add(
             documents=documents,
-            embeddings=embeddings,
-            metadatas=data,
+            embeddings=embeddings.tolist(),
+            metadatas=metadatas,
             ids=[str(i) for i in range(len(data))]
         )
         
@@ -89,94 +266,457 @@ class RAGEngine:
         Returns:
             List of recommended assessments (dicts)
         """
-        # Step 1: Handle URL inputs via FireCrawl
-        search_text = user_input
+        # Steps 1-2: Scrape + balance query, unless already cached
+        query_embedding = self._lookup_cached(user_input)
         
-        if user_input.startswith("http"):
-            print("🕷 URL detected. Scraping with FireCrawl...")
-            search_text = self._scrape_url(user_input)
+        if query_embedding is None:
+            query_embedding = self._embed_query(user_input)
+        
+        # Steps 3-5: Vector search and balance
+        return self._search([query_embedding])[0]
+    
+    
+    def process_queries(self, queries: list) -> list:
+        """
+        Batched version of process_query for evaluation workloads
+        
+        Scraping and Gemini fallbacks run in parallel threads (network-bound),
+        while KeyBERT keyword extraction and embeddings each run as one
+        batched forward pass.
+        
+        Args:
+            queries: Natural language queries or URLs
+        
+        Returns:
+            List of recommendation lists, aligned with queries
+        """
+        if not queries:
+            return []
+        
+        # Exact cache hits (dict also de-duplicates repeated queries)
+        embeddings = {q: self._lookup_cached(q) for q in queries}
+        misses = [q for q, emb in embeddings.items() if emb is None]
+        
+        if misses:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                search_texts = list(executor.map(self._search_text, misses))
+                raw_embeddings = self.embedder.encode(
+                    search_texts, batch_size=64, normalize_embeddings=True
+                )
+                
+                # Semantic cache hits skip Gemini
+                to_balance = []
+                for i, raw_embedding in enumerate(raw_embeddings):
+                    cached = self._semantic_lookup(raw_embedding)
+                    if cached is None:
+                        to_balance.append(i)
+                    else:
+                        embeddings[misses[i]] = cached
+                
+                # Cache + local KeyBERT in one batch; Gemini only for the rest
+                texts = [search_texts[i] for i in to_balance]
+                balanced = self._balance_queries_offline(texts, raw_embeddings[to_balance])
+                need_gemini = [j for j, b in enumerate(balanced) if b is None]
+                for j, b in zip(need_gemini, executor.map(
+                    self._balance_query_gemini, [texts[j] for j in need_gemini]
+                )):
+                    balanced[j] = b
+            
+            if balanced:
+                query_embeddings = self.embedder.encode(
+                    balanced, batch_size=64, convert_to_numpy=True
+                )
+                for i, query_embedding in zip(to_balance, query_embeddings):
+                    embeddings[misses[i]] = query_embedding
+            
+            for i, q in enumerate(misses):
+                self._cache_put(q, raw_embeddings[i], embeddings[q])
+        
+        return self._search([embeddings[q] for q in queries])
+    
+    
+    async def process_query_async(self, user_input: str):
+        """
+        Async version of process_query for the API
+        
+        Network calls (FireCrawl, Gemini) are awaited and CPU/local work
+        (embedding, ChromaDB) runs in worker threads, so the event loop
+        keeps serving other requests meanwhile.
+        """
+        # Steps 1-2: Scrape + balance query, unless already cached
+        query_embedding = self._lookup_cached(user_input)
         
-        # Step 2: Balance query (extract hard + soft skills)
-        balanced_query = self._balance_query(search_text)
+        if query_embedding is None:
+            query_embedding = await self._embed_query_async(user_input)
+        
+        # Steps 3-5: Vector search and balance
+        return (await asyncio.to_thread(self._search, [query_embedding]))[0]
+    
+    
+    async def aclose(self):
+        """Close the shared async HTTP client and the URL cache"""
+        await self._http.aclose()
+        self._url_cache.close()
+    
+    
+    def _search(self, query_embeddings: list, target_count: int = 10) -> list:
+        """
+        Vector search + result balancing for a batch of query embeddings
+        
+        Fetches only target_count results per query. Single-category results
+        are returned as-is; only when both knowledge and personality tests are
+        present but one has fewer than half the slots is the search widened
+        to 2 * target_count (the original candidate pool), batched across
+        those queries.
+        """
+        if not query_embeddings:
+            return []
         
-        # Step 3: Vector search
-        query_embedding = self.embedder.encode([balanced_query]).tolist()
         results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=20  # Get more, then filter
+            query_embeddings=[emb.tolist() for emb in query_embeddings],
+            n_results=target_count,
+            include=['metadatas']
         )
+        all_metadatas = [list(m) for m in (results['metadatas'] or [[] for _ in query_embeddings])]
+        
+        # Queries with both categories where one cannot fill its half
+        half = target_count // 2
+        widen = []
+        for i, metadatas in enumerate(all_metadatas):
+            categories = [result_category(m) for m in metadatas]
+            knowledge = categories.count(CAT_KNOWLEDGE)
+            personality = categories.count(CAT_PERSONALITY)
+            if knowledge and personality and min(knowledge, personality) < half:
+                widen.append(i)
+        
+        if widen:
+            extra = self.collection.query(
+                query_embeddings=[query_embeddings[i].tolist() for i in widen],
+                n_results=2 * target_count,
+                include=['metadatas']
+            )
+            for i, metadatas in zip(widen, extra['metadatas'] or []):
+                all_metadatas[i] = list(metadatas)
+        
+        return [
+            self._balance_results(metadatas, target_count=target_count)
+            for metadatas in all_metadatas
+        ]
+    
+    
+    def _search_text(self, user_input: str) -> str:
+        """Resolve user input to search text (scrapes URLs via FireCrawl)"""
+        if user_input.startswith("http"):
+            print("🕷 URL detected. Scraping with FireCrawl...")
+            return self._scrape_url(user_input)
+        return user_input
+    
+    
+    async def _search_text_async(self, user_input: str) -> str:
+        """Async version of _search_text"""
+        if user_input.startswith("http"):
+            print("🕷 URL detected. Scraping with FireCrawl...")
+            return await self._scrape_url_async(user_input)
+        return user_input
+    
+    
+    def _lookup_cached(self, user_input: str):
+        """Return the cached query embedding for an exact repeat of user_input"""
+        with self._cache_lock:
+            entry = self._emb_cache.get(user_input)
+            if entry is None:
+                return None
+            self._emb_cache.move_to_end(user_input)
+            return entry[1]
+    
+    
+    def _semantic_lookup(self, raw_embedding: np.ndarray):
+        """Return the query embedding of a cached near-duplicate, if any"""
+        if SEMANTIC_CACHE_THRESHOLD is None:
+            return None
+        
+        with self._cache_lock:
+            if not self._emb_cache:
+                return None
+            # Rows are filled in order until the cache is full, then reused
+            scores = self._emb_matrix[:len(self._emb_cache)] @ raw_embedding
+            best = int(np.argmax(scores))
+            entry = self._emb_cache.get(self._emb_keys[best])
+            if entry is None or scores[best] < SEMANTIC_CACHE_THRESHOLD:
+                return None
         
-        # Step 4: Convert to list of dicts
-        recommendations = []
-        if results['metadatas']:
-            for meta in results['metadatas'][0]:
-                recommendations.append(meta)
+        print(f"♻ Semantic cache hit (similarity {scores[best]:.3f})")
+        return entry[1]
+    
+    
+    def _cache_put(self, user_input: str, raw_embedding: np.ndarray, query_embedding: np.ndarray):
+        """Insert into the query cache, evicting the least recently used entry"""
+        with self._cache_lock:
+            if self._emb_matrix is None:
+                self._emb_matrix = np.zeros(
+                    (QUERY_CACHE_SIZE, len(raw_embedding)), dtype=np.float32
+                )
+            
+            # Reuse the row of an existing key, take the next free row, or
+            # evict the least recently used entry and take its row
+            if user_input in self._emb_cache:
+                row = self._emb_cache[user_input][0]
+            elif len(self._emb_cache) < QUERY_CACHE_SIZE:
+                row = len(self._emb_cache)
+            else:
+                _, (row, _) = self._emb_cache.popitem(last=False)
+            
+            self._emb_matrix[row] = raw_embedding
+            self._emb_keys[row] = user_input
+            self._emb_cache[user_input] = (row, query_embedding)
+            self._emb_cache.move_to_end(user_input)
+    
+    
+    def _embed_query(self, user_input: str) -> np.ndarray:
+        """
+        Scrape (if URL), balance and embed a query that missed the exact cache
+        
+        Before balancing, the raw text is compared against cached queries;
+        a near-duplicate above SEMANTIC_CACHE_THRESHOLD reuses its embedding.
+        """
+        # Step 1: Handle URL inputs via FireCrawl
+        search_text = self._search_text(user_input)
+        raw_embedding, query_embedding = self._prepare_query(search_text)
         
-        # Step 5: Balance results (ensure hard/soft skill mix)
-        balanced_results = self._balance_results(recommendations, target_count=10)
+        if query_embedding is None:
+            # Step 2: Balance query (extract hard + soft skills)
+            query_embedding = self._encode_balanced(self._balance_query(search_text, raw_embedding))
         
-        return balanced_results
+        self._cache_put(user_input, raw_embedding, query_embedding)
+        return query_embedding
+    
+    
+    async def _embed_query_async(self, user_input: str) -> np.ndarray:
+        """Async version of _embed_query (embedding runs in worker threads)"""
+        search_text = await self._search_text_async(user_input)
+        raw_embedding, query_embedding = await asyncio.to_thread(self._prepare_query, search_text)
+        
+        if query_embedding is None:
+            balanced_query = await self._balance_query_async(search_text, raw_embedding)
+            query_embedding = await asyncio.to_thread(self._encode_balanced, balanced_query)
+        
+        self._cache_put(user_input, raw_embedding, query_embedding)
+        return query_embedding
+    
+    
+    def _prepare_query(self, search_text: str):
+        """Embed the raw search text and check the semantic cache"""
+        raw_embedding = self.embedder.encode([search_text], normalize_embeddings=True)[0]
+        return raw_embedding, self._semantic_lookup(raw_embedding)
+    
+    
+    def _encode_balanced(self, balanced_query: str) -> np.ndarray:
+        """Embed a balanced query for vector search"""
+        return self.embedder.encode([balanced_query])[0]
     
     
     def _scrape_url(self, url: str) -> str:
         """Scrape job description from URL using FireCrawl"""
+        cached = self._url_cache.get(url)
+        if cached is not None:
+            print("📦 Using cached scrape for URL")
+            return cached
+        
         if not firecrawl:
             print("⚠ FireCrawl API key missing. Using URL as-is.")
             return url
         
         try:
             result = firecrawl.scrape_url(url, params={'formats': ['markdown']})
-            markdown_text = result.get('markdown', '')
-            
-            if markdown_text:
-                print(f"✅ Scraped {len(markdown_text)} characters from URL")
-                return markdown_text[:3000]  # Limit context window
-            else:
-                print("⚠ FireCrawl returned empty content")
-                return url
+            return self._store_scrape(url, result.get('markdown', ''))
+        
+        except Exception as e:
+            print(f"❌ FireCrawl error: {e}")
+            return url
+    
+    
+    async def _scrape_url_async(self, url: str) -> str:
+        """Async version of _scrape_url using the FireCrawl REST API"""
+        # diskcache does blocking SQLite I/O, keep it off the event loop
+        cached = await asyncio.to_thread(self._url_cache.get, url)
+        if cached is not None:
+            print("📦 Using cached scrape for URL")
+            return cached
+        
+        if not FIRECRAWL_KEY:
+            print("⚠ FireCrawl API key missing. Using URL as-is.")
+            return url
+        
+        try:
+            resp = await self._http.post(
+                FIRECRAWL_SCRAPE_URL,
+                headers={"Authorization": f"Bearer {FIRECRAWL_KEY}"},
+                json={"url": url, "formats": ["markdown"]}
+            )
+            resp.raise_for_status()
+            markdown_text = resp.json().get('data', {}).get('markdown', '')
+            return await asyncio.to_thread(self._store_scrape, url, markdown_text)
         
         except Exception as e:
             print(f"❌ FireCrawl error: {e}")
             return url
     
     
-    def _balance_query(self, text: str) -> str:
+    def _store_scrape(self, url: str, markdown_text: str) -> str:
+        """Clip scraped markdown and cache it, or fall back to the URL"""
+        if markdown_text:
+            print(f"✅ Scraped {len(markdown_text)} characters from URL")
+            text = markdown_text[:3000]  # Limit context window
+            self._url_cache.set(url, text, expire=URL_CACHE_TTL)
+            return text
+        
+        print("⚠ FireCrawl returned empty content")
+        return url
+    
+    
+    def _balance_query(self, text: str, doc_embedding=None) -> str:
         """
-        Use Gemini to extract and balance hard + soft skills from query
+        Extract and balance hard + soft skills from query
         
+        Tries the balanced-query cache and the local KeyBERT extractor first
+        and falls back to Gemini for short or sparse queries.
         This ensures we search for both technical and behavioral assessments
         """
-        if not GENAI_KEY:
-            print("⚠ Gemini API key missing. Skipping query balancing.")
+        balanced = self._balance_query_offline(text, doc_embedding)
+        if balanced is not None:
+            return balanced
+        
+        return self._balance_query_gemini(text)
+    
+    
+    def _balance_query_gemini(self, text: str) -> str:
+        """Balance a query with Gemini (after _balance_query_offline returned None)"""
+        try:
+            response = self._gemini_model.generate_content(BALANCE_PROMPT.format(text=text[:1500]))
+        except Exception as e:
+            print(f"❌ Gemini error: {e}")
             return text
         
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        return self._gemini_balanced(text, response)
+    
+    
+    async def _balance_query_async(self, text: str, doc_embedding=None) -> str:
+        """Async version of _balance_query (awaits Gemini instead of blocking)"""
+        balanced = await asyncio.to_thread(self._balance_query_offline, text, doc_embedding)
+        if balanced is not None:
+            return balanced
         
-        prompt = f"""
-You are an expert HR assessment analyst. Analyze this job requirement:
-"{text[:1500]}"
-
-Extract the key requirements in TWO categories:
-1. HARD SKILLS: Technical abilities, tools, programming languages, certifications, domain knowledge
-2. SOFT SKILLS: Personality traits, teamwork, leadership, communication, behavioral competencies
-
-Create a balanced search query that gives EQUAL weight to both categories.
-Format: "Technical: [list key hard skills] AND Behavioral: [list key soft skills]"
-
-Example Output: "Technical: Java, SQL, API development AND Behavioral: team collaboration, stakeholder management"
-
-If only one category is present, still structure the output the same way.
-"""
+        try:
+            response = await self._gemini_model.generate_content_async(BALANCE_PROMPT.format(text=text[:1500]))
+        except Exception as e:
+            print(f"❌ Gemini error: {e}")
+            return text
+        
+        return self._gemini_balanced(text, response)
+    
+    
+    def _balance_query_offline(self, text: str, doc_embedding=None):
+        """
+        Balance a query without calling Gemini
+        
+        Returns the cached or locally extracted balanced query, the text
+        itself when Gemini is not configured, or None if Gemini is needed.
+        doc_embedding is the raw embedding of text, if already computed.
+        """
+        doc_embeddings = None if doc_embedding is None else np.asarray(doc_embedding)[None, :]
+        return self._balance_queries_offline([text], doc_embeddings)[0]
+    
+    
+    def _balance_queries_offline(self, texts: list, doc_embeddings=None) -> list:
+        """Batched version of _balance_query_offline (one KeyBERT pass)"""
+        results = [None] * len(texts)
+        
+        with self._cache_lock:
+            for i, text in enumerate(texts):
+                balanced = self._balanced_cache.get(text)
+                if balanced is not None:
+                    self._balanced_cache.move_to_end(text)
+                    results[i] = balanced
+        
+        pending = [i for i, balanced in enumerate(results) if balanced is None]
+        local = self._balance_queries_local(
+            [texts[i] for i in pending],
+            None if doc_embeddings is None else np.asarray(doc_embeddings)[pending]
+        )
         
+        for i, balanced in zip(pending, local):
+            if balanced is not None:
+                results[i] = self._remember_balanced(texts[i], balanced)
+            elif self._gemini_model is None:
+                print("⚠ Gemini API key missing. Skipping query balancing.")
+                results[i] = texts[i]
+        
+        return results
+    
+    
+    def _gemini_balanced(self, text: str, response) -> str:
+        """Extract the balanced query from a Gemini response and cache it"""
         try:
-            response = model.generate_content(prompt)
             balanced = response.text.strip()
-            print(f"🎯 Balanced Query: {balanced[:100]}...")
-            return balanced
-        
-        except Exception as e:
+        except Exception as e:  # e.g. blocked response without text
             print(f"❌ Gemini error: {e}")
             return text
+        
+        print(f"🎯 Balanced Query: {balanced[:100]}...")
+        return self._remember_balanced(text, balanced)
+    
+    
+    def _remember_balanced(self, text: str, balanced: str) -> str:
+        """Store a balanced query in the LRU cache shared by sync and async paths"""
+        with self._cache_lock:
+            self._balanced_cache[text] = balanced
+            self._balanced_cache.move_to_end(text)
+            if len(self._balanced_cache) > QUERY_CACHE_SIZE:
+                self._balanced_cache.popitem(last=False)
+        return balanced
+    
+    
+    def _balance_queries_local(self, texts: list, doc_embeddings=None) -> list:
+        """
+        Build balanced queries locally from KeyBERT keywords
+        
+        All texts go through a single extract_keywords call (one batched
+        embedding pass). Passing the already computed raw embeddings as
+        doc_embeddings skips re-encoding the texts. An entry is None when
+        too few keywords are found, so the caller can fall back to Gemini.
+        """
+        if not texts:
+            return []
+        
+        try:
+            all_keywords = self._kw.extract_keywords(
+                texts, top_n=10, stop_words='english', doc_embeddings=doc_embeddings
+            )
+        except Exception as e:
+            print(f"❌ KeyBERT error: {e}")
+            return [None] * len(texts)
+        
+        if len(texts) == 1:  # KeyBERT unwraps single-document results
+            all_keywords = [all_keywords]
+        
+        return [self._format_keywords(keywords) for keywords in all_keywords]
+    
+    
+    def _format_keywords(self, keywords: list):
+        """Split KeyBERT keywords into the Technical / Behavioral query format"""
+        if len(keywords) < LOCAL_BALANCE_MIN_KEYWORDS:
+            return None
+        
+        technical, behavioral = [], []
+        for keyword, _ in keywords:
+            if SOFT_SKILL_RE.search(keyword):
+                behavioral.append(keyword)
+            else:
+                technical.append(keyword)
+        
+        balanced = f"Technical: {', '.join(technical)} AND Behavioral: {', '.join(behavioral)}"
+        print(f"🎯 Balanced Query (local): {balanced[:100]}...")
+        return balanced
     
     
     def _balance_results(self, results: list, target_count: int = 10) -> list:
@@ -196,11 +736,11 @@ If only one category is present, still structure the output the same way.
         other_tests = []
         
         for r in results:
-            test_types = r.get('test_type', [])
+            category = result_category(r)
             
-            if "Knowledge & Skills" in test_types or "Cognitive Ability" in test_types:
+            if category == CAT_KNOWLEDGE:
                 knowledge_tests.append(r)
-            elif "Personality & Behavior" in test_types:
+            elif category == CAT_PERSONALITY:
                 personality_tests.append(r)
             else:
                 other_tests.append(r)
@@ -3,12 +3,35 @@ from bs4 import BeautifulSoup
 import re
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None  # Fall back to BeautifulSoup + lxml
+
 DATA_PATH = "data/assessments.json"
 CATALOG_URL = "https://www.shl.com/solutions/products/product-catalog/"
 FALLBACK_PATH = "../bkcd/ass.json"
+PARTIAL_PATH = f"{DATA_PATH}.partial"
+CHECKPOINT_EVERY = 50
+
+# Precompiled patterns for _parse_page
+_DUR_RE = re.compile(r'(\d+)\s*(?:min|minute)')
+_KS_RE = re.compile(r'java|python|sql|coding|technical|skill')
+_PB_RE = re.compile(r'personality|behavior|leadership|opq')
+
+# One scraper per worker thread: reuses TLS connections and Cloudflare cookies
+_tls = threading.local()
+
+def _get_scraper():
+    scraper = getattr(_tls, "scraper", None)
+    if scraper is None:
+        scraper = cloudscraper.create_scraper()
+        _tls.scraper = scraper
+    return scraper
 
 def scrape_catalog():
     if os.path.exists(DATA_PATH):
@@ -27,7 +50,7 @@ def scrape_catalog():
     
     try:
         resp = scraper.get(CATALOG_URL, timeout=30)
-        soup = BeautifulSoup(resp.text, "html.parser")
+        soup = BeautifulSoup(resp.text, "lxml")
         
         for a in soup.find_all("a", href=True):
             if "/product-catalog/view/" in a['href']:
@@ -66,45 +89,60 @@ def scrape_catalog():
     
     print(f"Collected {len(links)} product links")
     
+    os.makedirs("data", exist_ok=True)
+    
+    # Resume from the checkpoint of an interrupted crawl, if any
     results = []
+    if os.path.exists(PARTIAL_PATH):
+        with open(PARTIAL_PATH, "r", encoding="utf-8") as f:
+            results = json.load(f)
+        print(f"Resuming from checkpoint: {len(results)} assessments already scraped")
+    done_urls = {r["url"] for r in results}
+    pending = sorted(links - done_urls)
+    
     with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(_parse_page, url): url for url in links}
-        for future in tqdm(as_completed(futures), total=len(links)):
-            res = future.result()
+        pages = executor.map(_parse_page, pending)
+        for i, res in enumerate(tqdm(pages, total=len(pending)), 1):
             if res:
                 results.append(res)
+            # Checkpoint partial progress so a crash doesn't lose everything
+            if i % CHECKPOINT_EVERY == 0:
+                _write_json_atomic(PARTIAL_PATH, results)
     
     print(f"Scraped {len(results)} assessments")
-    os.makedirs("data", exist_ok=True)
-    with open(DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    _write_json_atomic(DATA_PATH, results)
+    if os.path.exists(PARTIAL_PATH):
+        os.remove(PARTIAL_PATH)
     print(f"Saved {len(results)} assessments")
 
+def _write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
 def _parse_page(url):
     try:
-        scraper = cloudscraper.create_scraper()
+        scraper = _get_scraper()
         resp = scraper.get(url, timeout=10)
         if resp.status_code != 200:
             return None
         
-        soup = BeautifulSoup(resp.text, "html.parser")
-        text = soup.get_text(" ", strip=True)
-        lower_t = text.lower()
-        
-        name_tag = soup.find("h1")
-        if not name_tag:
+        name, text = _extract_name_and_text(resp.text)
+        if name is None:
             return None
-        name = name_tag.text.strip()
+        lower_t = text.lower()
         
         duration = 0
-        dur_match = re.search(r'(\d+)\s*(?:min|minute)', lower_t)
+        dur_match = _DUR_RE.search(lower_t)
         if dur_match:
             duration = int(dur_match.group(1))
         
         test_type = []
-        if any(x in lower_t for x in ["java", "python", "sql", "coding", "technical", "skill"]):
+        if _KS_RE.search(lower_t):
             test_type.append("Knowledge & Skills")
-        if any(x in lower_t for x in ["personality", "behavior", "leadership", "opq"]):
+        if _PB_RE.search(lower_t):
             test_type.append("Personality & Behavior")
         if not test_type:
             test_type = ["General Ability"]
@@ -116,10 +154,26 @@ def _parse_page(url):
             "duration": duration,
             "remote_support": "Yes" if "remote" in lower_t else "No",
             "adaptive_support": "Yes" if "adaptive" in lower_t else "No",
-            "test_type": test_type
+            "test_type": test_type,
+            # Canonical text embedded at index time (see RAGEngine._index_data)
+            "_doc": f"{name} {text[:800]} {' '.join(test_type)}"
         }
     except:
         return None
 
+def _extract_name_and_text(html):
+    """Return (h1 text, page text) using the fastest available C parser"""
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        # Match BeautifulSoup's get_text: skip script/style contents, keep <title>
+        tree.strip_tags(["script", "style", "noscript", "template"])
+        name_node = tree.css_first("h1")
+        text = tree.root.text(separator=" ", strip=True) if tree.root else ""
+        return (name_node.text(strip=True) if name_node else None), text
+    
+    soup = BeautifulSoup(html, "lxml")
+    name_tag = soup.find("h1")
+    return (name_tag.text.strip() if name_tag else None), soup.get_text(" ", strip=True)
+
 if __name__ == "__main__":
     scrape_catalog()